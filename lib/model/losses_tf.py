@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
-""" Custom Loss Functions for faceswap.py """
+""" Custom Loss Functions for faceswap.py
+
+The image losses are compiled with XLA by default on the Nvidia and CPU backends. XLA is not
+used on other backends. The default can be overridden by setting the environment variable
+``FACESWAP_XLA`` to ``1`` (enable) or ``0`` (disable) prior to launching Faceswap.
+"""
 
 from __future__ import absolute_import
 
 import logging
+import os
 from typing import Tuple
 
 import numpy as np
@@ -11,11 +17,67 @@ import tensorflow as tf
 
 # Ignore linting errors from Tensorflow's thoroughly broken import system
 from tensorflow.python.keras.engine import compile_utils  # noqa pylint:disable=no-name-in-module,import-error
-from tensorflow.keras import backend as K  # pylint:disable=import-error
+
+from lib.utils import get_backend
 
 logger = logging.getLogger(__name__)
 
 
+def _get_use_xla():
+    """ Obtain whether the loss functions should be compiled with XLA.
+
+    Returns
+    -------
+    bool
+        ``True`` if XLA should be used. Defaults to ``True`` on backends that support XLA
+        (Nvidia and CPU) unless overridden by the environment variable ``FACESWAP_XLA``
+    """
+    default = get_backend() in ("nvidia", "cpu")
+    env_value = os.environ.get("FACESWAP_XLA", "").strip().lower()
+    if env_value in ("1", "true", "yes", "on"):
+        retval = True
+    elif env_value in ("0", "false", "no", "off"):
+        retval = False
+    else:
+        if env_value:
+            logger.warning("Unrecognized value for FACESWAP_XLA: '%s'. Using default (%s)",
+                           env_value, default)
+        retval = default
+    logger.debug("Use XLA for losses: %s (backend: %s, FACESWAP_XLA: '%s')",
+                 retval, get_backend(), env_value)
+    return retval
+
+
+_USE_XLA = _get_use_xla()
+
+# 5x5 modified Scharr kernel with shape (5, 5, 1, 2)
+_SCHARR_KERNEL = np.array([[[[0.00070, 0.00070]],
+                           [[0.00520, 0.00370]],
+                           [[0.03700, 0.00000]],
+                           [[0.00520, -0.0037]],
+                           [[0.00070, -0.0007]]],
+                          [[[0.00370, 0.00520]],
+                           [[0.11870, 0.11870]],
+                           [[0.25890, 0.00000]],
+                           [[0.11870, -0.1187]],
+                           [[0.00370, -0.0052]]],
+                          [[[0.00000, 0.03700]],
+                           [[0.00000, 0.25890]],
+                           [[0.00000, 0.00000]],
+                           [[0.00000, -0.2589]],
+                           [[0.00000, -0.0370]]],
+                          [[[-0.0037, 0.00520]],
+                           [[-0.1187, 0.11870]],
+                           [[-0.2589, 0.00000]],
+                           [[-0.1187, -0.1187]],
+                           [[-0.0037, -0.0052]]],
+                          [[[-0.0007, 0.00070]],
+                           [[-0.0052, 0.00370]],
+                           [[-0.0370, 0.00000]],
+                           [[-0.0052, -0.0037]],
+                           [[-0.0007, -0.0007]]]], dtype="float32")
+
+
 class DSSIMObjective(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
     """ DSSIM Loss Function
 
@@ -38,14 +100,42 @@ class DSSIMObjective(tf.keras.losses.Loss):  # pylint:disable=too-few-public-met
     ------
     You should add a regularization term like a l2 loss in addition to this one.
     """
-    def __init__(self, k_1=0.01, k_2=0.03, filter_size=11, filter_sigma=1.5, max_value=1.0):
+    def __init__(self,
+                 k_1=0.01,
+                 k_2=0.03,
+                 filter_size=11,
+                 filter_sigma=1.5,
+                 max_value=1.0):
         super().__init__(name="DSSIMObjective", reduction=tf.keras.losses.Reduction.NONE)
         self._filter_size = filter_size
-        self._filter_sigma = filter_sigma
-        self._k_1 = k_1
-        self._k_2 = k_2
-        self._max_value = max_value
+        self._c_1 = (k_1 * max_value) ** 2
+        self._c_2 = (k_2 * max_value) ** 2
+        self._kernel = tf.constant(self._get_gaussian_kernel(filter_size, filter_sigma))
 
+    @classmethod
+    def _get_gaussian_kernel(cls, size, sigma):
+        """ Obtain the normalized 2D gaussian kernel used for calculating local image statistics.
+
+        Parameters
+        ----------
+        size: int
+            The height and width of the kernel
+        sigma: float
+            The width of the gaussian
+
+        Returns
+        -------
+        :class:`numpy.ndarray`
+            The gaussian kernel with shape `(size, size, 1, 1)`
+        """
+        coords = np.arange(size, dtype="float32") - (size - 1) / 2.0
+        gauss = np.square(coords) * (-0.5 / sigma ** 2)
+        gauss = np.exp(gauss[None, :] + gauss[:, None])
+        gauss /= gauss.sum()
+        return gauss.reshape((size, size, 1, 1)).astype("float32")
+
+    # Shapes are not relaxed, so that the image size can be validated when each shape is traced
+    @tf.function(experimental_compile=_USE_XLA)
     def call(self, y_true, y_pred):
         """ Call the DSSIM Loss Function.
 
@@ -61,16 +151,81 @@ class DSSIMObjective(tf.keras.losses.Loss):  # pylint:disable=too-few-public-met
         tensor
             The DSSIM Loss value
         """
-        ssim = tf.image.ssim(y_true,
-                             y_pred,
-                             self._max_value,
-                             filter_size=self._filter_size,
-                             filter_sigma=self._filter_sigma,
-                             k1=self._k_1,
-                             k2=self._k_2)
+        ssim = self._ssim(y_true, y_pred)
         dssim_loss = (1. - ssim) / 2.0
         return dssim_loss
 
+    def _check_image_size(self, image):
+        """ Check that the image is at least as large as the gaussian filter, as is enforced by
+        :func:`tf.image.ssim`.
+
+        Parameters
+        ----------
+        image: tensor
+            The image batch to check
+
+        Raises
+        ------
+        ValueError
+            If the image's static height or width is smaller than the filter size. Images with a
+            dynamic height or width are not validated
+        """
+        height, width = image.get_shape()[1:3]
+        if height is None or width is None:
+            # Graph assertions are dropped under XLA, so only static shapes can be validated
+            logger.debug("Unable to validate DSSIM image size for dynamic shape: %s",
+                         image.get_shape())
+            return
+        if min(height, width) < self._filter_size:
+            raise ValueError(f"DSSIM requires images of at least the filter size "
+                             f"({self._filter_size}px). Received {height}x{width}px")
+
+    def _ssim(self, y_true, y_pred):
+        """ Calculate the Structural Similarity between two batches of images.
+
+        Matches :func:`tf.image.ssim`, but the local statistics for all of the inputs are
+        obtained from a single convolution, with the inputs stacked on the batch axis.
+
+        Parameters
+        ----------
+        y_true: tensor
+            The ground truth value
+        y_pred: tensor
+            The predicted value
+
+        Returns
+        -------
+        tensor
+            The SSIM for each item in the batch
+        """
+        self._check_image_size(y_true)
+        # As with tf.image.ssim, statistics are calculated in float32 regardless of input dtype.
+        # Small variances and the C1/C2 constants lose their precision in float16
+        y_true = tf.cast(y_true, tf.float32)
+        y_pred = tf.cast(y_pred, tf.float32)
+        kernel = tf.broadcast_to(self._kernel,
+                                 [self._filter_size, self._filter_size, y_true.get_shape()[-1], 1])
+        stacked = tf.concat([y_true,
+                             y_pred,
+                             y_true * y_pred,
+                             tf.square(y_true) + tf.square(y_pred)], axis=0)
+        local = tf.nn.depthwise_conv2d(stacked,
+                                       kernel,
+                                       strides=[1, 1, 1, 1],
+                                       padding="VALID",
+                                       data_format="NHWC")
+        mean_true, mean_pred, mean_product, mean_squares = tf.split(local, 4, axis=0)
+
+        num_luminance = mean_true * mean_pred * 2.0
+        den_luminance = tf.square(mean_true) + tf.square(mean_pred)
+        luminance = (num_luminance + self._c_1) / (den_luminance + self._c_1)
+        contrast_structure = ((mean_product * 2.0 - num_luminance + self._c_2) /
+                              (mean_squares - den_luminance + self._c_2))
+
+        # Every channel has the same spatial size, so the mean of the per-channel means is a
+        # single reduction over all non-batch axes
+        return tf.reduce_mean(luminance * contrast_structure, axis=(1, 2, 3))
+
 
 class MSSSIMLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
     """ Multiscale Structural Similarity Loss Function
@@ -112,6 +267,27 @@ class MSSSIMLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
         self.max_value = max_value
         self.power_factors = power_factors
 
+    def _get_filter_size(self, im_size):
+        """ Obtain the gaussian filter size to use for the given image size.
+
+        Parameters
+        ----------
+        im_size: int
+            The height and width of the images that the loss will receive
+
+        Returns
+        -------
+        int
+            The requested filter size, capped to the size of the smallest scale
+        """
+        # filter size cannot be larger than the smallest scale
+        smallest_scale = im_size >> (len(self.power_factors) - 1)
+        logger.debug("image size: %s, smallest scale: %s", im_size, smallest_scale)
+        return min(self.filter_size, smallest_scale)
+
+    # tf.image.ssim_multiscale is not XLA compatible, so is traced but not compiled. Shapes are
+    # not relaxed, as the filter size must be resolved from a static image size for each trace
+    @tf.function(experimental_compile=False)
     def call(self, y_true, y_pred):
         """ Call the MS-SSIM Loss Function.
 
@@ -127,10 +303,8 @@ class MSSSIMLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
         tensor
             The MS-SSIM Loss value
         """
-        im_size = K.int_shape(y_true)[1]
-        # filter size cannot be larger than the smallest scale
-        smallest_scale = self._get_smallest_size(im_size, len(self.power_factors) - 1)
-        filter_size = min(self.filter_size, smallest_scale)
+        # Resolved from the static shape at trace time, as one instance may receive several sizes
+        filter_size = self._get_filter_size(y_true.shape[1])
 
         ms_ssim = tf.image.ssim_multiscale(y_true,
                                            y_pred,
@@ -143,28 +317,6 @@ class MSSSIMLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
         ms_ssim_loss = 1. - ms_ssim
         return ms_ssim_loss
 
-    def _get_smallest_size(self, size, idx):
-        """ Recursive function to obtain the smallest size that the image will be scaled to.
-
-        Parameters
-        ----------
-        size: int
-            The current scaled size to iterate through
-        idx: int
-            The current iteration to be performed. When iteration hits zero the value will
-            be returned
-
-        Returns
-        -------
-        int
-            The smallest size the image will be scaled to based on the original image size and
-            the amount of scaling factors that will occur
-        """
-        logger.debug("scale id: %s, size: %s", idx, size)
-        if idx > 0:
-            size = self._get_smallest_size(size // 2, idx - 1)
-        return size
-
 
 class GeneralizedLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
     """  Generalized function used to return a large variety of mathematical loss functions.
@@ -192,7 +344,11 @@ class GeneralizedLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-me
         super().__init__(name="generalized_loss")
         self.alpha = alpha
         self.beta = beta
+        self._abs_2_minus_alpha = abs(2. - alpha)
+        self._half_alpha = alpha / 2.
+        self._coef = self._abs_2_minus_alpha / alpha
 
+    @tf.function(experimental_relax_shapes=True, experimental_compile=_USE_XLA)
     def call(self, y_true, y_pred):
         """ Call the Generalized Loss Function
 
@@ -208,20 +364,25 @@ class GeneralizedLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-me
         tensor
             The loss value from the results of function(y_pred - y_true)
         """
-        diff = y_pred - y_true
-        second = (K.pow(K.pow(diff/self.beta, 2.) / K.abs(2. - self.alpha) + 1.,
-                        (self.alpha / 2.)) - 1.)
-        loss = (K.abs(2. - self.alpha)/self.alpha) * second
-        loss = K.mean(loss, axis=-1) * self.beta
+        # Calculated in float32, as small residuals lose their precision (and squares of large
+        # scaled residuals overflow) in float16
+        diff = (tf.cast(y_pred, tf.float32) - tf.cast(y_true, tf.float32)) / self.beta
+        # (x^2 / c + 1)^(a / 2) - 1 as expm1/log1p for precision around x = 0
+        second = tf.math.expm1(self._half_alpha *
+                               tf.math.log1p(diff * diff / self._abs_2_minus_alpha))
+        loss = self._coef * second
+        loss = tf.reduce_mean(loss, axis=-1) * self.beta
         return loss
 
 
 class LInfNorm(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
-    """ Calculate the L-inf norm as a loss function. """
+    """ Calculate the L-inf norm as a loss function.
+    """
     def __init__(self):
         super().__init__(name="l_inf_norm_loss")
 
     @classmethod
+    @tf.function(experimental_relax_shapes=True, experimental_compile=_USE_XLA)
     def call(cls, y_true, y_pred):
         """ Call the L-inf norm loss function.
 
@@ -235,12 +396,10 @@ class LInfNorm(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
         Returns
         -------
         tensor
-            The loss value
+            The mean over channels of the maximum spatial absolute difference for each item in
+            the batch, with shape `(batch_size,)`
         """
-        diff = K.abs(y_true - y_pred)
-        max_loss = K.max(diff, axis=(1, 2), keepdims=True)
-        loss = K.mean(max_loss, axis=-1)
-        return loss
+        return tf.reduce_mean(tf.reduce_max(tf.abs(y_true - y_pred), axis=(1, 2)), axis=-1)
 
 
 class GradientLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
@@ -256,10 +415,16 @@ class GradientLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-metho
     TV+TV2 Regularization with Non-Convex Sparseness-Inducing Penalty for Image Restoration,
     Chengwu Lu & Hua Huang, 2014 - http://downloads.hindawi.com/journals/mpe/2014/790547.pdf
     """
+    # Paddings for one pixel of symmetric padding on the (batch, height, width, channels) axes
+    _pad_x = ((0, 0), (0, 0), (1, 1), (0, 0))
+    _pad_y = ((0, 0), (1, 1), (0, 0), (0, 0))
+    _pad_xy = ((0, 0), (1, 1), (1, 1), (0, 0))
+
     def __init__(self):
         super().__init__(name="generalized_loss")
         self.generalized_loss = GeneralizedLoss(alpha=1.9999)
 
+    @tf.function(experimental_relax_shapes=True, experimental_compile=_USE_XLA)
     def call(self, y_true, y_pred):
         """ Call the gradient loss function.
 
@@ -277,91 +442,87 @@ class GradientLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-metho
         """
         tv_weight = 1.0
         tv2_weight = 1.0
-        loss = 0.0
-        loss += tv_weight * (self.generalized_loss(self._diff_x(y_true), self._diff_x(y_pred)) +
-                             self.generalized_loss(self._diff_y(y_true), self._diff_y(y_pred)))
-        loss += tv2_weight * (self.generalized_loss(self._diff_xx(y_true), self._diff_xx(y_pred)) +
-                              self.generalized_loss(self._diff_yy(y_true), self._diff_yy(y_pred)) +
-                              self.generalized_loss(self._diff_xy(y_true), self._diff_xy(y_pred))
-                              * 2.)
-        loss = loss / (tv_weight + tv2_weight)
+        # Unreduced loss for all 5 gradients in one pass, with shape (5, batch, height, width)
+        per_gradient = self.generalized_loss.call(self._stack_gradients(y_true),
+                                                  self._stack_gradients(y_pred))
+        # GeneralizedLoss always calculates in float32
+        weights = tf.constant([tv_weight, tv_weight, tv2_weight, tv2_weight, tv2_weight * 2.],
+                              dtype=tf.float32)
+        loss = tf.tensordot(weights, per_gradient, axes=1) / (tv_weight + tv2_weight)
         # TODO simplify to use MSE instead
         return loss
 
+    @classmethod
+    def _stack_gradients(cls, img):
+        """ Stack the first and second order gradients of an image.
+
+        Parameters
+        ----------
+        img: tensor
+            The image batch to obtain gradients for
+
+        Returns
+        -------
+        tensor
+            The x, y, x-x, y-y and x-y gradients stacked on a new leading axis
+        """
+        return tf.stack([cls._diff_x(img),
+                         cls._diff_y(img),
+                         cls._diff_xx(img),
+                         cls._diff_yy(img),
+                         cls._diff_xy(img)], axis=0)
+
+    @classmethod
+    def _symmetric_pad(cls, img, paddings):
+        """ Pad an image by replicating its edge pixels.
+
+        Parameters
+        ----------
+        img: tensor
+            The image batch to pad
+        paddings: tuple
+            The amount of padding to apply before and after each axis
+
+        Returns
+        -------
+        tensor
+            The padded image batch
+        """
+        return tf.pad(img,  # pylint:disable=unexpected-keyword-arg,no-value-for-parameter
+                      paddings,
+                      mode="SYMMETRIC")
+
     @classmethod
     def _diff_x(cls, img):
         """ X Difference """
-        x_left = img[:, :, 1:2, :] - img[:, :, 0:1, :]
-        x_inner = img[:, :, 2:, :] - img[:, :, :-2, :]
-        x_right = img[:, :, -1:, :] - img[:, :, -2:-1, :]
-        x_out = K.concatenate([x_left, x_inner, x_right], axis=2)
-        return x_out * 0.5
+        padded = cls._symmetric_pad(img, cls._pad_x)
+        return 0.5 * (padded[:, :, 2:, :] - padded[:, :, :-2, :])
 
     @classmethod
     def _diff_y(cls, img):
         """ Y Difference """
-        y_top = img[:, 1:2, :, :] - img[:, 0:1, :, :]
-        y_inner = img[:, 2:, :, :] - img[:, :-2, :, :]
-        y_bot = img[:, -1:, :, :] - img[:, -2:-1, :, :]
-        y_out = K.concatenate([y_top, y_inner, y_bot], axis=1)
-        return y_out * 0.5
+        padded = cls._symmetric_pad(img, cls._pad_y)
+        return 0.5 * (padded[:, 2:, :, :] - padded[:, :-2, :, :])
 
     @classmethod
     def _diff_xx(cls, img):
         """ X-X Difference """
-        x_left = img[:, :, 1:2, :] + img[:, :, 0:1, :]
-        x_inner = img[:, :, 2:, :] + img[:, :, :-2, :]
-        x_right = img[:, :, -1:, :] + img[:, :, -2:-1, :]
-        x_out = K.concatenate([x_left, x_inner, x_right], axis=2)
-        return x_out - 2.0 * img
+        padded = cls._symmetric_pad(img, cls._pad_x)
+        return padded[:, :, 2:, :] + padded[:, :, :-2, :] - 2.0 * img
 
     @classmethod
     def _diff_yy(cls, img):
         """ Y-Y Difference """
-        y_top = img[:, 1:2, :, :] + img[:, 0:1, :, :]
-        y_inner = img[:, 2:, :, :] + img[:, :-2, :, :]
-        y_bot = img[:, -1:, :, :] + img[:, -2:-1, :, :]
-        y_out = K.concatenate([y_top, y_inner, y_bot], axis=1)
-        return y_out - 2.0 * img
+        padded = cls._symmetric_pad(img, cls._pad_y)
+        return padded[:, 2:, :, :] + padded[:, :-2, :, :] - 2.0 * img
 
     @classmethod
     def _diff_xy(cls, img):
         """ X-Y Difference """
-        # xout1
-        top_left = img[:, 1:2, 1:2, :] + img[:, 0:1, 0:1, :]
-        inner_left = img[:, 2:, 1:2, :] + img[:, :-2, 0:1, :]
-        bot_left = img[:, -1:, 1:2, :] + img[:, -2:-1, 0:1, :]
-        xy_left = K.concatenate([top_left, inner_left, bot_left], axis=1)
-
-        top_mid = img[:, 1:2, 2:, :] + img[:, 0:1, :-2, :]
-        mid_mid = img[:, 2:, 2:, :] + img[:, :-2, :-2, :]
-        bot_mid = img[:, -1:, 2:, :] + img[:, -2:-1, :-2, :]
-        xy_mid = K.concatenate([top_mid, mid_mid, bot_mid], axis=1)
-
-        top_right = img[:, 1:2, -1:, :] + img[:, 0:1, -2:-1, :]
-        inner_right = img[:, 2:, -1:, :] + img[:, :-2, -2:-1, :]
-        bot_right = img[:, -1:, -1:, :] + img[:, -2:-1, -2:-1, :]
-        xy_right = K.concatenate([top_right, inner_right, bot_right], axis=1)
-
-        # Xout2
-        top_left = img[:, 0:1, 1:2, :] + img[:, 1:2, 0:1, :]
-        inner_left = img[:, :-2, 1:2, :] + img[:, 2:, 0:1, :]
-        bot_left = img[:, -2:-1, 1:2, :] + img[:, -1:, 0:1, :]
-        xy_left = K.concatenate([top_left, inner_left, bot_left], axis=1)
-
-        top_mid = img[:, 0:1, 2:, :] + img[:, 1:2, :-2, :]
-        mid_mid = img[:, :-2, 2:, :] + img[:, 2:, :-2, :]
-        bot_mid = img[:, -2:-1, 2:, :] + img[:, -1:, :-2, :]
-        xy_mid = K.concatenate([top_mid, mid_mid, bot_mid], axis=1)
-
-        top_right = img[:, 0:1, -1:, :] + img[:, 1:2, -2:-1, :]
-        inner_right = img[:, :-2, -1:, :] + img[:, 2:, -2:-1, :]
-        bot_right = img[:, -2:-1, -1:, :] + img[:, -1:, -2:-1, :]
-        xy_right = K.concatenate([top_right, inner_right, bot_right], axis=1)
-
-        xy_out1 = K.concatenate([xy_left, xy_mid, xy_right], axis=2)
-        xy_out2 = K.concatenate([xy_left, xy_mid, xy_right], axis=2)
-        return (xy_out1 - xy_out2) * 0.25
+        padded = cls._symmetric_pad(img, cls._pad_xy)
+        diagonal = padded[:, 2:, 2:, :] + padded[:, :-2, :-2, :]
+        anti_diagonal = padded[:, 2:, :-2, :] + padded[:, :-2, 2:, :]
+        return 0.25 * (diagonal - anti_diagonal)
 
 
 class GMSDLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
@@ -376,7 +537,10 @@ class GMSDLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
     """
     def __init__(self):
         super().__init__(name="gmsd_loss", reduction=tf.keras.losses.Reduction.NONE)
+        self._compute_dtype = tf.keras.mixed_precision.global_policy().compute_dtype
+        self._scharr_kernel = tf.constant(_SCHARR_KERNEL, dtype=self._compute_dtype)
 
+    @tf.function(experimental_relax_shapes=True, experimental_compile=_USE_XLA)
     def call(self, y_true, y_pred):
         """ Return the Gradient Magnitude Similarity Deviation Loss.
 
@@ -391,27 +555,30 @@ class GMSDLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
         Returns
         -------
         tensor
-            The loss value
+            The loss value for each item in the batch, with shape `(batch_size,)`
         """
-        true_edge = self._scharr_edges(y_true, True)
-        pred_edge = self._scharr_edges(y_pred, True)
+        # Edge maps and deviation are calculated in the compute dtype to halve memory traffic
+        # under mixed precision. Both batches are stacked to obtain edges in a single convolution
+        combined = tf.cast(tf.concat([y_true, y_pred], axis=0), self._compute_dtype)
+        true_edge, pred_edge = tf.split(self._scharr_edges(combined, True), 2, axis=0)
         ephsilon = 0.0025
         upper = 2.0 * true_edge * pred_edge
-        lower = K.square(true_edge) + K.square(pred_edge)
+        lower = tf.square(true_edge) + tf.square(pred_edge)
         gms = (upper + ephsilon) / (lower + ephsilon)
-        gmsd = K.std(gms, axis=(1, 2, 3), keepdims=True)
-        gmsd = K.squeeze(gmsd, axis=-1)
+        # The deviation is reduced in float32, as small variances underflow in float16. Epsilon
+        # prevents an infinite gradient at 0
+        _, variance = tf.nn.moments(tf.cast(gms, tf.float32), axes=[1, 2, 3], keepdims=False)
+        gmsd = tf.sqrt(variance + 1e-12)
         return gmsd
 
-    @classmethod
-    def _scharr_edges(cls, image, magnitude):
+    def _scharr_edges(self, image, magnitude):
         """ Returns a tensor holding modified Scharr edge maps.
 
         Parameters
         ----------
         image: tensor
-            Image tensor with shape [batch_size, h, w, d] and type float32. The image(s) must be
-            2x2 or larger.
+            Image tensor with shape [batch_size, h, w, d] in the compute dtype. The image(s) must
+            be 2x2 or larger.
         magnitude: bool
             Boolean to determine if the edge magnitude or edge direction is returned
 
@@ -425,37 +592,11 @@ class GMSDLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
 
         # Define vertical and horizontal Scharr filters.
         static_image_shape = image.get_shape()
-        image_shape = K.shape(image)
-
-        # 5x5 modified Scharr kernel ( reshape to (5,5,1,2) )
-        matrix = np.array([[[[0.00070, 0.00070]],
-                            [[0.00520, 0.00370]],
-                            [[0.03700, 0.00000]],
-                            [[0.00520, -0.0037]],
-                            [[0.00070, -0.0007]]],
-                           [[[0.00370, 0.00520]],
-                            [[0.11870, 0.11870]],
-                            [[0.25890, 0.00000]],
-                            [[0.11870, -0.1187]],
-                            [[0.00370, -0.0052]]],
-                           [[[0.00000, 0.03700]],
-                            [[0.00000, 0.25890]],
-                            [[0.00000, 0.00000]],
-                            [[0.00000, -0.2589]],
-                            [[0.00000, -0.0370]]],
-                           [[[-0.0037, 0.00520]],
-                            [[-0.1187, 0.11870]],
-                            [[-0.2589, 0.00000]],
-                            [[-0.1187, -0.1187]],
-                            [[-0.0037, -0.0052]]],
-                           [[[-0.0007, 0.00070]],
-                            [[-0.0052, 0.00370]],
-                            [[-0.0370, 0.00000]],
-                            [[-0.0052, -0.0037]],
-                            [[-0.0007, -0.0007]]]])
+        image_shape = tf.shape(image)
+
         num_kernels = [2]
-        kernels = K.constant(matrix, dtype='float32')
-        kernels = K.tile(kernels, [1, 1, image_shape[-1], 1])
+        # Broadcast rather than tile so the per-channel kernel is never materialized under XLA
+        kernels = tf.broadcast_to(self._scharr_kernel, [5, 5, static_image_shape[-1], 2])
 
         # Use depth-wise convolution to calculate edge maps per channel.
         # Output tensor has shape [batch_size, h, w, d * num_kernels].
@@ -463,14 +604,18 @@ class GMSDLoss(tf.keras.losses.Loss):  # pylint:disable=too-few-public-methods
         padded = tf.pad(image,  # pylint:disable=unexpected-keyword-arg,no-value-for-parameter
                         pad_sizes,
                         mode='REFLECT')
-        output = K.depthwise_conv2d(padded, kernels)
+        output = tf.nn.depthwise_conv2d(padded,
+                                        kernels,
+                                        strides=[1, 1, 1, 1],
+                                        padding="VALID",
+                                        data_format="NHWC")
 
         if not magnitude:  # direction of edges
             # Reshape to [batch_size, h, w, d, num_kernels].
-            shape = K.concatenate([image_shape, num_kernels], axis=0)
-            output = K.reshape(output, shape=shape)
+            shape = tf.concat([image_shape, num_kernels], axis=0)
+            output = tf.reshape(output, shape=shape)
             output.set_shape(static_image_shape.concatenate(num_kernels))
-            output = tf.atan(K.squeeze(output[:, :, :, :, 0] / output[:, :, :, :, 1], axis=None))
+            output = tf.atan(tf.squeeze(output[:, :, :, :, 0] / output[:, :, :, :, 1]))
         # magnitude of edges -- unified x & y edges don't work well with Neural Networks
         return output
 
@@ -525,6 +670,7 @@ class LossWrapper():
         self._loss_weights.append(weight)
         self._mask_channels.append(mask_channel)
 
+    @tf.function(experimental_relax_shapes=True)
     def __call__(self, y_true: tf.Tensor, y_pred: tf.Tensor) -> tf.Tensor:
         """ Call the sub loss functions for the loss wrapper.
 
@@ -546,15 +692,19 @@ class LossWrapper():
         :class:`tensorflow.Tensor`
             The final weighted loss
         """
-        loss = 0.0
+        # Losses sharing a mask channel share the masked inputs
+        masked = {channel: self._apply_mask(y_true, y_pred, channel)
+                  for channel in set(self._mask_channels)}
+        scaled = []
         for func, weight, mask_channel in zip(self._loss_functions,
                                               self._loss_weights,
                                               self._mask_channels):
             logger.debug("Processing loss function: (func: %s, weight: %s, mask_channel: %s)",
                          func, weight, mask_channel)
-            n_true, n_pred = self._apply_mask(y_true, y_pred, mask_channel)
-            loss += (func(n_true, n_pred) * weight)
-        return loss
+            n_true, n_pred = masked[mask_channel]
+            scaled.append(func(n_true, n_pred) * weight)
+        # Sum in a single op rather than a sequential chain of adds
+        return tf.add_n(scaled)
 
     @classmethod
     def _apply_mask(cls,
@@ -588,11 +738,12 @@ class LossWrapper():
             return y_true[..., :3], y_pred[..., :3]
 
         logger.debug("Applying mask from channel %s", mask_channel)
-        mask = K.expand_dims(y_true[..., mask_channel], axis=-1)
+        mask = tf.expand_dims(y_true[..., mask_channel], axis=-1)
         mask_as_k_inv_prop = 1 - mask_prop
         mask = (mask * mask_prop) + mask_as_k_inv_prop
 
-        n_true = K.concatenate([y_true[..., i:i + 1] * mask for i in range(3)], axis=-1)
-        n_pred = K.concatenate([y_pred[..., i:i + 1] * mask for i in range(3)], axis=-1)
+        # mask has a single channel so broadcasts across the color channels
+        n_true = y_true[..., :3] * mask
+        n_pred = y_pred[..., :3] * mask
 
         return n_true, n_pred
@@ -14,14 +14,17 @@ if get_backend() == "amd":
     from keras import backend as K, losses as k_losses
 else:
     # Ignore linting errors from Tensorflow's thoroughly broken import system
+    import tensorflow as tf
     from tensorflow.keras import backend as K, losses as k_losses  # pylint:disable=import-error
 
-_PARAMS = [(losses.GeneralizedLoss(), (2, 16, 16)),
-           (losses.GradientLoss(), (2, 16, 16)),
-           # TODO Make sure these output dimensions are correct
-           (losses.GMSDLoss(), (2, 1, 1)),
-           # TODO Make sure these output dimensions are correct
-           (losses.LInfNorm(), (2, 1, 1))]
+if get_backend() == "amd":
+    _SHAPES = [(2, 16, 16), (2, 16, 16), (2, 1, 1), (2, 1, 1)]
+else:
+    # Keras reduces to a scalar, except for GMSD which returns the per-item loss
+    _SHAPES = [(), (), (2, ), ()]
+_PARAMS = list(zip([losses.GeneralizedLoss(), losses.GradientLoss(), losses.GMSDLoss(),
+                    losses.LInfNorm()],
+                   _SHAPES))
 _IDS = ["GeneralizedLoss", "GradientLoss", "GMSDLoss", "LInfNorm"]
 _IDS = [f"{loss}[{get_backend().upper()}]" for loss in _IDS]
 
@@ -38,7 +41,8 @@ def test_loss_output(loss_func, output_shape):
         assert K.eval(objective_output).shape == output_shape
     else:
         output = objective_output.numpy()
-        assert output.dtype == "float32" and not np.isnan(output)
+        assert output.dtype == "float32" and not np.isnan(output).any()
+        assert output.shape == output_shape
 
 
 _LWPARAMS = [losses.GeneralizedLoss(), losses.GradientLoss(), losses.GMSDLoss(),
@@ -70,3 +74,57 @@ def test_loss_wrapper(loss_func):
     else:
         output = output.numpy()
         assert output.dtype == "float32" and not np.isnan(output)
+
+
+def test_gradient_loss_diff_xy():
+    """ Test the x-y gradient of the gradient loss is the discrete mixed partial derivative """
+    if get_backend() == "amd":
+        pytest.skip("Mixed partial fix is not applied to the PlaidML Gradient Loss")
+    # The mixed partial of f(x, y) = x * y is 1 everywhere
+    coords = np.arange(8, dtype="float32")
+    img = np.outer(coords, coords)[None, :, :, None]
+    diff_xy = losses.GradientLoss._diff_xy  # pylint:disable=protected-access
+    output = diff_xy(K.constant(img)).numpy()
+    assert np.allclose(output[:, 1:-1, 1:-1, :], 1.0)
+
+
+_SSIM_SHAPES = [(2, 16, 16, 3), (4, 32, 24, 3), (1, 11, 11, 1)]
+_SSIM_SETTINGS = [(0.01, 0.03, 1.0), (0.02, 0.05, 255.0)]
+
+
+@pytest.mark.parametrize("shape", _SSIM_SHAPES, ids=[str(shape) for shape in _SSIM_SHAPES])
+@pytest.mark.parametrize(["k_1", "k_2", "max_value"],
+                         _SSIM_SETTINGS,
+                         ids=[f"k1={k1},k2={k2},max={mv}" for k1, k2, mv in _SSIM_SETTINGS])
+def test_dssim_matches_tf_ssim(shape, k_1, k_2, max_value):
+    """ Test the DSSIM loss matches the DSSIM obtained from Tensorflow's SSIM implementation """
+    if get_backend() == "amd":
+        pytest.skip("Tensorflow SSIM is not available for PlaidML")
+    y_a = np.random.random(shape).astype("float32") * max_value
+    y_b = np.random.random(shape).astype("float32") * max_value
+    output = losses.DSSIMObjective(k_1=k_1, k_2=k_2, max_value=max_value)(y_a, y_b).numpy()
+    expected = (1. - tf.image.ssim(y_a, y_b, max_value, k1=k_1, k2=k_2).numpy()) / 2.0
+    assert np.allclose(output, expected, atol=1e-5)
+
+
+def test_dssim_small_image():
+    """ Test the DSSIM loss rejects images that are smaller than the gaussian filter """
+    if get_backend() == "amd":
+        pytest.skip("Image size is not validated by the PlaidML DSSIM loss")
+    y_a = K.constant(np.random.random((2, 8, 8, 3)))
+    y_b = K.constant(np.random.random((2, 8, 8, 3)))
+    with pytest.raises(ValueError):
+        losses.DSSIMObjective(filter_size=11)(y_a, y_b)
+
+
+def test_ms_ssim_multiple_sizes():
+    """ Test a single MS-SSIM loss instance handles outputs of differing sizes, as received from
+    multi-scale model outputs """
+    if get_backend() == "amd":
+        pytest.skip("MS-SSIM Loss is not currently compatible with PlaidML")
+    loss_func = losses.MSSSIMLoss()
+    for size in (128, 32, 64):
+        y_a = K.constant(np.random.random((2, size, size, 3)))
+        y_b = K.constant(np.random.random((2, size, size, 3)))
+        output = loss_func(y_a, y_b).numpy()
+        assert output.shape == (2, ) and not np.isnan(output).any()